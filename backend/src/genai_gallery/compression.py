@@ -0,0 +1,223 @@
+"""
+Response compression.
+
+API responses are compressed on the fly by `CompressionMiddleware`, with
+brotli when the client accepts it and the optional `brotli` package is
+installed, gzip otherwise. The frontend bundle is compressed at build time
+instead (see `precompress` in frontend/vite.config.ts): `.br` and `.gz`
+siblings of each file are served as they are by `PrecompressedStaticFiles`
+and `precompressed_file_response`.
+"""
+import gzip
+import mimetypes
+import os
+from email.utils import parsedate
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MINIMUM_SIZE = 1024
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/x-ndjson",
+    "image/svg+xml",
+    "text/",
+)
+
+# Build artifacts with a content hash in their name never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Everything else served from the bundle (index.html, favicon...) is revalidated
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Precompressed siblings, in order of preference
+PRECOMPRESSED_SUFFIXES = ((".br", "br"), (".gz", "gzip"))
+
+
+def accepted_encodings(headers: Headers) -> dict:
+    """Content codings of Accept-Encoding, `*` included, mapped to their q-value."""
+    encodings = {}
+    for part in headers.get("accept-encoding", "").split(","):
+        name, *params = [param.strip() for param in part.split(";")]
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        encodings[name.lower()] = q
+    return encodings
+
+
+def choose_encoding(headers: Headers, available) -> str:
+    """
+    The coding of `available`, in order of preference, with the highest
+    q-value for the client, or None if it accepts none of them.
+    """
+    encodings = accepted_encodings(headers)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = encodings.get(encoding, encodings.get("*", 0.0))
+        # Ties go to the earlier, preferred coding
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _is_compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """
+    Compresses complete (non streamed) responses of compressible types that
+    are at least `minimum_size` bytes. Streamed responses, like exports, and
+    responses that are already encoded pass through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _choose_encoding(self, scope):
+        return choose_encoding(Headers(scope=scope), ("br", "gzip") if brotli else ("gzip",))
+
+    def _compress(self, encoding: str, body: bytes) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        encoding = self._choose_encoding(scope) if scope["type"] == "http" else None
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether to compress
+                start_message = message
+                return
+
+            if start_message is None:
+                await send(message)
+                return
+
+            if message["type"] != "http.response.body":
+                # e.g. http.response.pathsend, the response is sent as it is,
+                # but never ahead of its start
+                pending_start, start_message = start_message, None
+                await send(pending_start)
+                await send(message)
+                return
+
+            pending_start, start_message = start_message, None
+            headers = MutableHeaders(raw=pending_start["headers"])
+            body = message.get("body", b"")
+
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or not _is_compressible(headers.get("content-type", ""))
+                or len(body) < self.minimum_size
+            ):
+                await send(pending_start)
+                await send(message)
+                return
+
+            # Off the event loop, large JSON responses take a while to compress
+            body = await anyio.to_thread.run_sync(self._compress, encoding, body)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(pending_start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _precompressed_variant(path: str, headers: Headers):
+    available = {encoding: path + suffix for suffix, encoding in PRECOMPRESSED_SUFFIXES if os.path.isfile(path + suffix)}
+    encoding = choose_encoding(headers, available)
+    if encoding is None:
+        return None, None
+    return available[encoding], encoding
+
+
+def is_not_modified(response_headers: Headers, request_headers: Headers) -> bool:
+    """
+    Whether a conditional request can be answered with 304, as StaticFiles
+    does for plain files.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return response_headers.get("etag") in tags
+
+    if_modified_since = parsedate(request_headers.get("if-modified-since", ""))
+    last_modified = parsedate(response_headers.get("last-modified", ""))
+    return if_modified_since is not None and last_modified is not None and if_modified_since >= last_modified
+
+
+def precompressed_file_response(path: str, headers: Headers, cache_control: str = REVALIDATE_CACHE_CONTROL,
+                                stat_result: os.stat_result = None) -> Response:
+    """
+    FileResponse for `path`, using its precompressed sibling when there is
+    one the client accepts, or 304 when the client's copy is still fresh.
+    """
+    response = FileResponse(path, stat_result=stat_result or os.stat(path))
+
+    variant, encoding = _precompressed_variant(path, headers)
+    if variant:
+        # Validators follow the original file, so they change with it and
+        # StaticFiles and the SPA fallback agree on them. The encoding is
+        # part of the ETag, each variant is a different representation.
+        etag = response.headers["etag"]
+        response = FileResponse(
+            variant,
+            # Typed after the original file, not the .br/.gz one
+            media_type=mimetypes.guess_type(path)[0] or "text/plain",
+            headers={
+                "Content-Encoding": encoding,
+                "ETag": f'{etag[:-1]}-{encoding}"',
+                "Last-Modified": response.headers["last-modified"],
+            },
+        )
+
+    response.headers["Cache-Control"] = cache_control
+    response.headers.add_vary_header("Accept-Encoding")
+    if is_not_modified(response.headers, headers):
+        return NotModifiedResponse(response.headers)
+    return response
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles serving precompressed siblings, with a fixed Cache-Control."""
+
+    def __init__(self, *args, cache_control: str = REVALIDATE_CACHE_CONTROL, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        if status_code != 200:
+            return super().file_response(full_path, stat_result, scope, status_code)
+        return precompressed_file_response(str(full_path), Headers(scope=scope), self.cache_control, stat_result)
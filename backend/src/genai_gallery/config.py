@@ -1,11 +1,79 @@
 import os
+from dataclasses import dataclass
+from functools import lru_cache
 
-IMAGES_DIR = os.getenv("IMAGES_DIR")
-if not IMAGES_DIR:
-    raise ValueError("IMAGES_DIR environment variable must be set")
+# Configuration is resolved lazily so that importing the package (workers,
+# tooling, `uvx genai_gallery --help`) does not require IMAGES_DIR to be set.
 
-if not os.path.exists(IMAGES_DIR):
-    raise ValueError(f"IMAGES_DIR {IMAGES_DIR} does not exist")
 
-DB_PATH = os.path.join(IMAGES_DIR, "gallery.db")
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
+@dataclass(frozen=True)
+class LibraryRoot:
+    """A configured images directory, indexed in its own `gallery.db`."""
+    name: str
+    path: str
+
+    @property
+    def db_path(self) -> str:
+        return os.path.join(self.path, "gallery.db")
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.path, "gallery.vectors")
+
+    @property
+    def database_url(self) -> str:
+        return f"sqlite:///{self.db_path}"
+
+
+@lru_cache(maxsize=None)
+def get_roots() -> tuple[LibraryRoot, ...]:
+    """
+    Parses IMAGES_DIR, which holds one or more library roots separated by
+    `os.pathsep` (`:` on POSIX, `;` on Windows). Each entry is either a path,
+    named after its last component, or `name=path`. A single existing
+    directory is always one root, even if its path contains a separator.
+    """
+    images_dir = os.getenv("IMAGES_DIR")
+    if not images_dir:
+        raise ValueError("IMAGES_DIR environment variable must be set")
+
+    entries = [images_dir] if os.path.isdir(images_dir) else images_dir.split(os.pathsep)
+
+    roots = []
+    named = False
+    for entry in entries:
+        entry = entry.strip()
+        if not entry:
+            continue
+
+        name, sep, path = entry.partition("=")
+        if sep and not os.path.exists(entry):
+            named = True
+        else:
+            path = entry
+            name = os.path.basename(os.path.abspath(entry))
+
+        if not os.path.exists(path):
+            raise ValueError(f"IMAGES_DIR {path} does not exist")
+        if any(root.name == name for root in roots):
+            raise ValueError(f"Duplicate library root name {name!r}, use name=path to disambiguate")
+
+        roots.append(LibraryRoot(name=name, path=path))
+
+    if not roots:
+        raise ValueError("IMAGES_DIR environment variable must be set")
+
+    # A single root's name never shows up in paths, so anything goes unless
+    # it was given explicitly
+    if named or len(roots) > 1:
+        for root in roots:
+            if not root.name or "/" in root.name or root.name.startswith("."):
+                raise ValueError(f"Invalid library root name {root.name!r} for {root.path}")
+
+    return tuple(roots)
+
+def get_root(name: str) -> LibraryRoot:
+    for root in get_roots():
+        if root.name == name:
+            return root
+    raise KeyError(name)
@@ -1,19 +1,43 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import threading
 
-from .config import SQLALCHEMY_DATABASE_URL
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import declarative_base, sessionmaker
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+from .config import LibraryRoot
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Every library root has its own database. Engines are created on first use
+# (see `get_engine`) instead of at import time.
+_engines = {}
+_session_factories = {}
+_engines_lock = threading.Lock()
+
+
+def _configure_connection(dbapi_connection, connection_record):
+    # WAL lets the worker that is syncing write while the others keep serving
+    # reads; the timeout covers waits for the single SQLite writer.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def get_engine(root: LibraryRoot):
+    engine = _engines.get(root.name)
+    if engine is not None:
+        return engine
+
+    with _engines_lock:
+        if root.name not in _engines:
+            engine = create_engine(
+                root.database_url, connect_args={"check_same_thread": False, "timeout": 30}
+            )
+            event.listen(engine, "connect", _configure_connection)
+            _session_factories[root.name] = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            _engines[root.name] = engine
+        return _engines[root.name]
+
+
+def get_session(root: LibraryRoot):
+    get_engine(root)
+    return _session_factories[root.name]()
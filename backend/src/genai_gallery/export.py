@@ -0,0 +1,180 @@
+"""
+Streaming archive writers for bulk exports.
+
+Archives are generated chunk by chunk while they are being sent, from an
+iterable of entries that is consumed as it goes, so memory use stays
+constant whatever the export size. Media files are stored as they are,
+since PNG, JPEG, WebP and video are already compressed; only the optional
+manifest is deflated. Its lines are written to a spooled temporary file as
+each file is added, and the manifest is copied into the archive last.
+
+Entries are `(arcname, full_path, record)` tuples, `record` being the JSON
+serializable manifest line for that file, or None without a manifest.
+"""
+import json
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_NAME = "manifest.jsonl"
+
+FORMATS = {
+    "zip": "application/zip",
+    "tar": "application/x-tar",
+}
+
+
+class _StreamSink:
+    """
+    Write-only, non seekable file object collecting what an archive writer
+    outputs until the generator drains it.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Manifests up to this size stay in memory, bigger ones go to disk
+MANIFEST_SPOOL_SIZE = 1024 * 1024
+
+
+def _manifest_file():
+    return tempfile.SpooledTemporaryFile(max_size=MANIFEST_SPOOL_SIZE)
+
+
+def _add_record(manifest_file, record):
+    if manifest_file is not None:
+        manifest_file.write(json.dumps(record).encode() + b"\n")
+
+
+def _zip_date_time(mtime: float):
+    # ZIP timestamps can't represent anything before 1980
+    return max(time.localtime(mtime)[:6], (1980, 1, 1, 0, 0, 0))
+
+
+def stream_zip(entries, manifest: bool = False):
+    sink = _StreamSink()
+    manifest_file = _manifest_file() if manifest else None
+
+    # zipfile detects that the sink can't seek and writes data descriptors
+    # after each member instead of going back to patch the local headers
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for arcname, full_path, record in entries:
+            try:
+                src = open(full_path, "rb")
+            except OSError as e:
+                print(f"Skipping {full_path} in export: {e}")
+                continue
+
+            with src:
+                st = os.fstat(src.fileno())
+                info = zipfile.ZipInfo(arcname, date_time=_zip_date_time(st.st_mtime))
+                info.compress_type = zipfile.ZIP_STORED
+                # Known upfront so zipfile switches to ZIP64 for files over 4GB
+                info.file_size = st.st_size
+
+                with archive.open(info, "w") as dest:
+                    while chunk := src.read(CHUNK_SIZE):
+                        dest.write(chunk)
+                        yield sink.drain()
+
+            _add_record(manifest_file, record)
+            yield sink.drain()
+
+        if manifest_file is not None:
+            with manifest_file:
+                info = zipfile.ZipInfo(MANIFEST_NAME, date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.file_size = manifest_file.tell()
+                manifest_file.seek(0)
+                with archive.open(info, "w") as dest:
+                    while chunk := manifest_file.read(CHUNK_SIZE):
+                        dest.write(chunk)
+                        yield sink.drain()
+
+    yield sink.drain()
+
+
+def _tar_member(info: tarfile.TarInfo, src):
+    """Header, data and padding of one tar member, read in chunks."""
+    yield info.tobuf(format=tarfile.PAX_FORMAT)
+
+    remaining = info.size
+    while remaining > 0:
+        chunk = src.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            # File shrank while exporting, the header already promised info.size bytes
+            chunk = b"\0" * min(CHUNK_SIZE, remaining)
+        remaining -= len(chunk)
+        yield chunk
+
+    rest = info.size % tarfile.BLOCKSIZE
+    if rest:
+        yield b"\0" * (tarfile.BLOCKSIZE - rest)
+
+
+def stream_tar(entries, manifest: bool = False):
+    # Tar members are written by hand rather than with tarfile.addfile, which
+    # copies a whole file at once and gives no chance to yield in between
+    written = 0
+    manifest_file = _manifest_file() if manifest else None
+
+    for arcname, full_path, record in entries:
+        try:
+            src = open(full_path, "rb")
+        except OSError as e:
+            print(f"Skipping {full_path} in export: {e}")
+            continue
+
+        with src:
+            st = os.fstat(src.fileno())
+            info = tarfile.TarInfo(arcname)
+            info.size = st.st_size
+            info.mtime = st.st_mtime
+            info.mode = 0o644
+
+            for chunk in _tar_member(info, src):
+                written += len(chunk)
+                yield chunk
+
+        _add_record(manifest_file, record)
+
+    if manifest_file is not None:
+        with manifest_file:
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = manifest_file.tell()
+            info.mtime = time.time()
+            info.mode = 0o644
+            manifest_file.seek(0)
+            for chunk in _tar_member(info, manifest_file):
+                written += len(chunk)
+                yield chunk
+
+    # End of archive marker, padded to a full record like tarfile does
+    end = b"\0" * (tarfile.BLOCKSIZE * 2)
+    written += len(end)
+    rest = written % tarfile.RECORDSIZE
+    if rest:
+        end += b"\0" * (tarfile.RECORDSIZE - rest)
+    yield end
+
+
+def stream_archive(format: str, entries, manifest: bool = False):
+    writer = stream_zip if format == "zip" else stream_tar
+    # Skip the empty chunks produced while zipfile buffers small headers
+    return (chunk for chunk in writer(entries, manifest) if chunk)
@@ -0,0 +1,83 @@
+"""
+Helpers for serving several library roots as one gallery.
+
+With a single root, paths are exactly the paths relative to that root, as
+they always were. With several roots, every path is prefixed by the root
+name (`archive/2024/img_00001.png`), so the roots show up as top level
+directories and `/images/<root>/...` serves their files.
+"""
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import schemas
+from .config import LibraryRoot, get_root, get_roots
+
+# Queries for each root run on that root's own threads, so a slow disk can
+# only ever queue up its own queries. Syncs never run here, see sync.request_sync.
+WORKERS_PER_ROOT = 4
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def is_federated() -> bool:
+    return len(get_roots()) > 1
+
+
+def to_virtual_path(root: LibraryRoot, rel_path: str) -> str:
+    if not is_federated():
+        return rel_path
+    return f"{root.name}/{rel_path}" if rel_path else root.name
+
+
+def resolve_path(path: str) -> tuple[LibraryRoot, str]:
+    """
+    Splits a gallery path into its root and the path relative to it.
+    Raises KeyError if the path does not belong to any root.
+    """
+    roots = get_roots()
+    if len(roots) == 1:
+        return roots[0], path
+
+    name, _, rel_path = path.partition("/")
+    return get_root(name), rel_path
+
+
+def serialize_image(root: LibraryRoot, image) -> schemas.Image:
+    # Built while the root's session is still open, the path is rewritten
+    # to the gallery path
+    result = schemas.Image.model_validate(image)
+    result.path = to_virtual_path(root, image.path)
+    return result
+
+
+def _get_executor(root: LibraryRoot) -> ThreadPoolExecutor:
+    with _executors_lock:
+        if root.name not in _executors:
+            _executors[root.name] = ThreadPoolExecutor(
+                max_workers=WORKERS_PER_ROOT, thread_name_prefix=f"root-{root.name}"
+            )
+        return _executors[root.name]
+
+
+def fan_out(fn, roots=None) -> list:
+    """
+    Calls `fn(root)` for every root concurrently and returns the results in
+    the order of the roots.
+    """
+    roots = get_roots() if roots is None else roots
+    if len(roots) == 1:
+        return [fn(roots[0])]
+
+    futures = [_get_executor(root).submit(fn, root) for root in roots]
+    return [future.result() for future in futures]
+
+
+def merge_by_created_at(results, descending: bool = True, key=None):
+    """
+    K-way merge of per-root image lists that are already sorted by
+    `created_at`. `key` returns the `created_at` of each item, when the
+    items are not images themselves.
+    """
+    key = key or (lambda image: image.created_at)
+    return heapq.merge(*results, key=key, reverse=descending)
@@ -1,57 +1,53 @@
 import os
-import hashlib
+import heapq
+import shutil
+import re
+from contextlib import asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form
+from itertools import chain, islice
+from fastapi import FastAPI, APIRouter, HTTPException, Request, File, UploadFile, Form
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from typing import List
-import shutil
-import re
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy import text
 from typing import List
 
 from . import models
 from . import schemas
-from . import database
-from .database import engine, get_db
-from .config import IMAGES_DIR
-
-models.Base.metadata.create_all(bind=engine)
-
-# Create FTS5 table if not exists
-with engine.connect() as connection:
-    connection.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(image_id UNINDEXED, content)"))
-    connection.commit()
-
-app = FastAPI()
-
-
-# Allow CORS for frontend
-allowed_origins_env = os.environ.get("CORS_ALLOWED_ORIGINS", "http://localhost:8188")
-allowed_origins = [origin.strip() for origin in allowed_origins_env.split(",")]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=allowed_origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+from . import sync
+from .compression import (
+    IMMUTABLE_CACHE_CONTROL, MINIMUM_SIZE, CompressionMiddleware, PrecompressedStaticFiles,
+    precompressed_file_response,
 )
+from .database import get_session
+from .export import FORMATS, stream_archive
+from .config import LibraryRoot, get_root, get_roots
+from .library import fan_out, is_federated, merge_by_created_at, resolve_path, serialize_image, to_virtual_path
+from .migrations import run_migrations
+from .sync import calculate_sha1, extract_metadata, request_sync
 
-# Mount images directory to serve static files
-app.mount("/images", StaticFiles(directory=IMAGES_DIR), name="images")
+router = APIRouter()
 
-# Mount frontend assets
+# Matches read from the database at a time while an export is streamed
+EXPORT_BATCH_SIZE = 500
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema migrations run once per process start instead of on import, for
+    # every root concurrently, and the initial indexes are built in the
+    # background (see /api/ready).
+    fan_out(run_migrations)
+    sync.start_initial_sync()
+    yield
 
-@app.get("/api/images")
-def list_images(sort: str = "desc", q: str = None, db: Session = Depends(get_db)):
-    sync_images(db)
-    
+
+def query_images(db: Session, q: str = None, sort: str = "desc"):
+    """
+    Builds the images query for a search string and sort order, shared by
+    the listing, browse and search endpoints.
+    """
     query = db.query(models.Image)
     
     if q:
@@ -80,25 +76,154 @@ def list_images(sort: str = "desc", q: str = None, db: Session = Depends(get_db)
         query = query.order_by(models.Image.created_at.asc())
     else:
         query = query.order_by(models.Image.created_at.desc())
-        
-    images = query.all()
+
+    return query
+
+def load_images(root: LibraryRoot, db: Session, image_ids) -> list:
+    """
+    Loads and serializes the given images of a root with their metadata, in
+    the order of `image_ids`.
+    """
+    images = {
+        img.id: img
+        for img in db.query(models.Image)
+        .options(selectinload(models.Image.metadata_items))
+        .filter(models.Image.id.in_(image_ids))
+    }
+    return [serialize_image(root, images[image_id]) for image_id in image_ids if image_id in images]
+
+def search_roots(q: str = None, sort: str = "desc", offset: int = 0, limit: int = None):
+    """
+    Runs the search on every library root and returns the total number of
+    matches and the images from `offset`, at most `limit` of them, merged by
+    `created_at`. Only those images are loaded and serialized.
+    """
+    # Syncs run in the background, the query tasks only read, so a root that
+    # is slow to walk never holds back the results of the others
+    for root in get_roots():
+        request_sync(root)
+
+    end = None if limit is None else offset + limit
+
+    if not is_federated():
+        root = get_roots()[0]
+        db = get_session(root)
+        try:
+            query = query_images(db, q, sort)
+            total = query.count()
+            images = query.options(selectinload(models.Image.metadata_items)).offset(offset).limit(limit).all()
+            return total, [serialize_image(root, img) for img in images]
+        finally:
+            db.close()
+
+    def match_keys(root):
+        # Only the sort keys of each root's first `end` matches, which is
+        # enough to tell which of them make it into the page
+        db = get_session(root)
+        try:
+            query = query_images(db, q, sort).with_entities(models.Image.created_at, models.Image.id)
+            if end is None:
+                keys = query.all()
+                total = len(keys)
+            else:
+                total = query.count()
+                keys = query.limit(end).all()
+            return total, [(created_at, root, image_id) for created_at, image_id in keys]
+        finally:
+            db.close()
+
+    results = fan_out(match_keys)
+    total = sum(total for total, _ in results)
+    merged = merge_by_created_at([keys for _, keys in results], descending=sort != "asc", key=lambda key: key[0])
+    page = list(islice(merged, offset, end))
+
+    page_ids = {}
+    for _, root, image_id in page:
+        page_ids.setdefault(root, []).append(image_id)
+
+    def load_page(root):
+        db = get_session(root)
+        try:
+            return {image.id: image for image in load_images(root, db, page_ids[root])}
+        finally:
+            db.close()
+
+    loaded = dict(zip(page_ids, fan_out(load_page, tuple(page_ids))))
+    return total, [loaded[root][image_id] for _, root, image_id in page if image_id in loaded[root]]
+
+@router.get("/api/images", response_model=List[schemas.Image])
+def list_images(sort: str = "desc", q: str = None):
+    _, images = search_roots(q, sort)
     return images
 
-@app.get("/api/images/{image_id}", response_model=schemas.Image)
-def get_image_details(image_id: str, db: Session = Depends(get_db)):
-    image = db.query(models.Image).filter(models.Image.id == image_id).first()
+@router.get("/api/images/{image_id}", response_model=schemas.Image)
+def get_image_details(image_id: str):
+    def find_image(root):
+        db = get_session(root)
+        try:
+            image = db.query(models.Image).filter(models.Image.id == image_id).first()
+            return serialize_image(root, image) if image else None
+        finally:
+            db.close()
+
+    image = next((image for image in fan_out(find_image) if image), None)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     return image
 
-@app.get("/api/browse", response_model=schemas.BrowseResponse)
+@router.get("/api/images/{image_id}/similar-prompts", response_model=List[schemas.SimilarImage])
+def get_similar_prompts(image_id: str, limit: int = 12):
+    """
+    Images whose positive prompts are most similar to the given image's,
+    across all roots, best first. See vectors.py.
+    """
+    from . import vectors
+
+    def has_image(root):
+        db = get_session(root)
+        try:
+            return db.query(models.Image.id).filter(models.Image.id == image_id).first() is not None
+        finally:
+            db.close()
+
+    root = next((root for root, found in zip(get_roots(), fan_out(has_image)) if found), None)
+    if root is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    db = get_session(root)
+    try:
+        vector = vectors.get_vector(root, db, image_id)
+    finally:
+        db.close()
+    if vector is None:
+        # No prompt text, or not vectorized by a sync yet
+        return []
+
+    def search_root(root):
+        db = get_session(root)
+        try:
+            matches = vectors.find_similar(root, db, vector, limit, exclude_id=image_id)
+            images = {
+                img.id: img
+                for img in db.query(models.Image).filter(models.Image.id.in_([id for _, id in matches])).all()
+            }
+            return [
+                schemas.SimilarImage(**serialize_image(root, images[id]).model_dump(), score=score)
+                for score, id in matches
+                if id in images
+            ]
+        finally:
+            db.close()
+
+    return heapq.nlargest(limit, chain.from_iterable(fan_out(search_root)), key=lambda image: image.score)
+
+@router.get("/api/browse", response_model=schemas.BrowseResponse)
 def browse(
     path: str = "", 
     sort: str = "desc", 
     q: str = None, 
     page: int = 1,
     limit: int = 50,
-    db: Session = Depends(get_db)
 ):
     import math
     # Security check to prevent path traversal
@@ -107,12 +232,11 @@ def browse(
     
     # Ensure clean relative path (empty string for root)
     path = path.strip("/")
-    
-    full_path = os.path.join(IMAGES_DIR, path)
-    if not os.path.exists(full_path) or not os.path.isdir(full_path):
-         raise HTTPException(status_code=404, detail="Directory not found")
 
-    sync_images(db)
+    # Out of range values give an empty page rather than an error
+    page = max(page, 1)
+    limit = max(limit, 0)
+    start = (page - 1) * limit
 
     # List subdirectories (only if not searching, or keep them?)
     # If searching, we probably want to search everything recursively, ignoring the current directory Browse?
@@ -121,7 +245,25 @@ def browse(
     # If q is present, we ignore directory structure and return all matching images.
     
     directories = []
-    if not q:
+    if q:
+        # Search Mode: Global Search (ignores path), across all roots
+        total_count, paginated_results = search_roots(q, sort, offset=start, limit=limit)
+    elif is_federated() and not path:
+        # Top level of several roots: the roots themselves are the directories
+        directories = [{"name": root.name, "path": root.name} for root in get_roots()]
+        paginated_results = []
+        total_count = 0
+    else:
+        # Browse Mode: only the root the directory belongs to is involved
+        try:
+            root, rel_path = resolve_path(path)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Directory not found")
+
+        full_path = os.path.join(root.path, rel_path)
+        if not os.path.exists(full_path) or not os.path.isdir(full_path):
+             raise HTTPException(status_code=404, detail="Directory not found")
+
         try:
             with os.scandir(full_path) as it:
                 for entry in it:
@@ -134,54 +276,23 @@ def browse(
             pass
         directories.sort(key=lambda x: x["name"])
 
-    # List images
-    query = db.query(models.Image)
-    
-    if q:
-        # Search Mode: Global Search (ignores path)
-        if ':' in q:
-            key, val = q.split(':', 1)
-            query = query.join(models.ImageMetadata).filter(
-                models.ImageMetadata.key == key.strip(),
-                models.ImageMetadata.value.like(f"%{val.strip()}%")
-            )
-        else:
-            safe_q = q.replace('"', '""')
-            fts_sql = text("SELECT image_id FROM search_index WHERE search_index MATCH :q")
-            matched_ids = [row[0] for row in db.execute(fts_sql, {"q": f'"{safe_q}"'}).fetchall()]
-            query = query.filter(models.Image.id.in_(matched_ids))
-    else:
-        # Browse Mode: Filter by keys/indexes or filter in python later
-        # Optimization: To avoid fetching all images, maybe we can filter by path prefix? 
-        # But images stores relative path.
-        pass # We will filter by directory in Python as before if no search
-    
-    if sort == "asc":
-        query = query.order_by(models.Image.created_at.asc())
-    else:
-        query = query.order_by(models.Image.created_at.desc())
-
-    all_images = query.all()
-    
-    results = []
-    if q:
-        # Return all results
-        results = all_images
-    else:
-        # Filter by current directory
-        for img in all_images:
-            img_dir = os.path.dirname(img.path)
-            if img_dir == path:
-                results.append(img)
-            
+        request_sync(root)
+        db = get_session(root)
+        try:
+            # Filter by current directory in python as before, on ids and
+            # paths only; just the requested page is loaded
+            image_ids = [
+                image_id
+                for image_id, image_path in query_images(db, sort=sort).with_entities(models.Image.id, models.Image.path)
+                if os.path.dirname(image_path) == rel_path
+            ]
+            paginated_results = load_images(root, db, image_ids[start:start + limit])
+        finally:
+            db.close()
+        total_count = len(image_ids)
     
     # Pagination Logic
-    total_count = len(results)
     total_pages = math.ceil(total_count / limit) if limit > 0 else 1
-    
-    start = (page - 1) * limit
-    end = start + limit
-    paginated_results = results[start:end]
             
     return {
         "directories": directories,
@@ -191,45 +302,20 @@ def browse(
         "pages": total_pages
     }
 
-@app.get("/api/search", response_model=schemas.PaginatedImageResponse)
+@router.get("/api/search", response_model=schemas.PaginatedImageResponse)
 def search_images(
     q: str = None, 
     page: int = 1, 
     limit: int = 12, 
     sort: str = "desc", 
-    db: Session = Depends(get_db)
 ):
     import math
-    sync_images(db)
-    
-    query = db.query(models.Image)
-    
-    # 1. Apply Filtering (Same as list_images)
-    if q:
-        if ':' in q:
-            key, val = q.split(':', 1)
-            query = query.join(models.ImageMetadata).filter(
-                models.ImageMetadata.key == key.strip(),
-                models.ImageMetadata.value.like(f"%{val.strip()}%")
-            )
-        else:
-            safe_q = q.replace('"', '""')
-            fts_sql = text("SELECT image_id FROM search_index WHERE search_index MATCH :q")
-            matched_ids = [row[0] for row in db.execute(fts_sql, {"q": f'"{safe_q}"'}).fetchall()]
-            query = query.filter(models.Image.id.in_(matched_ids))
-
-    # 2. Apply Sorting
-    if sort == "asc":
-        query = query.order_by(models.Image.created_at.asc())
-    else:
-        query = query.order_by(models.Image.created_at.desc())
-        
-    # 3. Pagination
-    total_count = query.count()
+    # Out of range values give an empty page rather than an error
+    page = max(page, 1)
+    limit = max(limit, 0)
     offset = (page - 1) * limit
-    
-    # Apply limit/offset
-    images = query.offset(offset).limit(limit).all()
+
+    total_count, images = search_roots(q, sort, offset=offset, limit=limit)
     
     total_pages = math.ceil(total_count / limit) if limit > 0 else 1
     
@@ -241,11 +327,82 @@ def search_images(
         "pages": total_pages
     }
 
-@app.post("/api/upload", response_model=List[schemas.Image])
+@router.get("/api/export")
+def export_images(
+    q: str = None,
+    sort: str = "desc",
+    path: str = "",
+    recursive: bool = False,
+    format: str = "zip",
+    manifest: bool = False,
+):
+    """
+    Streams an archive (`zip` or `tar`) of the images matching the same
+    filters as browse and search. `path` limits the export to a directory,
+    including its subdirectories with `recursive`. With `manifest`, a
+    `manifest.jsonl` with every exported image's details is appended.
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format, must be one of: {', '.join(FORMATS)}")
+
+    # Security check to prevent path traversal
+    if ".." in path or path.startswith("/"):
+        raise HTTPException(status_code=400, detail="Invalid path")
+    path = path.strip("/")
+
+    roots = get_roots()
+    # Without a path every match is exported, exactly like /api/search
+    rel_dir = None
+    if path:
+        try:
+            root, rel_dir = resolve_path(path)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Directory not found")
+        roots = (root,)
+
+    def in_directory(image_path):
+        if rel_dir is None:
+            return True
+        if recursive:
+            return not rel_dir or image_path.startswith(os.path.join(rel_dir, ""))
+        return os.path.dirname(image_path) == rel_dir
+
+    def matches(root):
+        # Read lazily, in batches, while the archive is being streamed
+        db = get_session(root)
+        try:
+            query = query_images(db, q, sort)
+            if manifest:
+                query = query.options(selectinload(models.Image.metadata_items))
+            for img in query.yield_per(EXPORT_BATCH_SIZE):
+                if in_directory(img.path):
+                    yield root, img
+        finally:
+            db.close()
+
+    for root in roots:
+        request_sync(root)
+
+    def entries():
+        merged = merge_by_created_at(
+            [matches(root) for root in roots], descending=sort != "asc", key=lambda match: match[1].created_at
+        )
+        for root, img in merged:
+            # The manifest line is only built as its file is written
+            record = serialize_image(root, img).model_dump(mode="json") if manifest else None
+            yield to_virtual_path(root, img.path).replace(os.sep, "/"), os.path.join(root.path, img.path), record
+
+    filename = f"genai_gallery_export.{format}"
+    return StreamingResponse(
+        stream_archive(format, entries(), manifest=manifest),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@router.post("/api/upload", response_model=List[schemas.Image])
 async def upload_images(
     files: List[UploadFile] = File(...),
     filename_prefix: str = Form(""),
-    db: Session = Depends(get_db)
 ):
     # 1. Validation and Path Resolution
     # Parse prefix into directory and base filename
@@ -256,6 +413,21 @@ async def upload_images(
     if ".." in prefix_path or prefix_path.startswith("/"):
         raise HTTPException(status_code=400, detail="Invalid prefix path")
 
+    # With several roots, a leading root name picks the root to upload to,
+    # anything else goes to the first configured root
+    root = get_roots()[0]
+    if is_federated():
+        name, _, rest = prefix_path.partition("/")
+        if rest and any(r.name == name for r in get_roots()):
+            root, prefix_path = get_root(name), rest
+
+    db = get_session(root)
+    try:
+        return await _save_uploads(root, db, files, prefix_path)
+    finally:
+        db.close()
+
+async def _save_uploads(root: LibraryRoot, db: Session, files: List[UploadFile], prefix_path: str):
     # Split into directory and base prefix
     # If prefix ends with slash, base is empty? No, traditionally prefix is "folder/myimage" -> folder, myimage
     # If just "folder/", assume base is "image"? Or just require full prefix?
@@ -266,7 +438,7 @@ async def upload_images(
     dirname = os.path.dirname(prefix_path)
     basename = os.path.basename(prefix_path)
     
-    full_dir_path = os.path.join(IMAGES_DIR, dirname)
+    full_dir_path = os.path.join(root.path, dirname)
     
     # Ensure directory exists
     os.makedirs(full_dir_path, exist_ok=True)
@@ -322,7 +494,7 @@ async def upload_images(
         if not file_hash:
             continue
             
-        rel_path = os.path.relpath(save_path, IMAGES_DIR)
+        rel_path = os.path.relpath(save_path, root.path)
         created_at = datetime.now()
         
         # Check if hash already exists? 
@@ -398,6 +570,8 @@ async def upload_images(
                 
                 # Update FTS
                 db.execute(text("DELETE FROM search_index WHERE image_id = :id"), {"id": img_obj.id})
+                # The next sync computes its new prompt vector
+                db.execute(text("DELETE FROM prompt_vectors WHERE image_id = :id"), {"id": img_obj.id})
                 search_content = [img_obj.path, getattr(img_obj, 'prompt', '') or ""]
                 search_content.extend([v for k, v in meta_items])
                 full_text = " ".join(search_content)
@@ -408,276 +582,137 @@ async def upload_images(
                 
         # Reload to get relationships
         db.refresh(img_obj)
-        created_images.append(img_obj)
+        created_images.append(serialize_image(root, img_obj))
         
     return created_images
 
-def calculate_sha1(filepath: str) -> str:
-    sha1 = hashlib.sha1()
-    try:
-        with open(filepath, 'rb') as f:
-            while True:
-                data = f.read(65536)
-                if not data:
-                    break
-                sha1.update(data)
-        return sha1.hexdigest()
-    except IOError:
-        return None
-
-def extract_metadata(filepath: str) -> dict:
+@router.get("/api/ready")
+def readiness():
     """
-    Extracts ComfyUI Prompt metadata from PNG files.
-    Returns a dict of flattened key-value pairs.
+    Reports whether the initial index of every library root is warm.
+    Returns 503 while any startup sync is still running, or if one failed.
     """
-    try:
-        from PIL import Image
-        with Image.open(filepath) as img:
-            # ComfyUI often stores prompt in 'prompt' or 'workflow' text chunks
-            # We are interested in 'prompt' which contains the inputs
-            meta = img.info
-            prompt_json = meta.get('prompt')
-            if not prompt_json:
-                return {}
-            
-            import json
-            data = json.loads(prompt_json)
-            
-            flattened = {}
-            
-            # Helper to check if value is scalar
-            def is_scalar(v):
-                return isinstance(v, (str, int, float, bool)) and v is not None
-
-            # Flatten inputs
-            # Structure: { <node_id>: { "inputs": { ... }, "class_type": ... }, ... }
-            for node_id, node_data in data.items():
-                inputs = node_data.get('inputs', {})
-                for key, value in inputs.items():
-                    # Ignore 'type' and 'device' as per user request
-                    # Also ignoring non-scalar values (lists, dicts are usually connections/arrays we don't need for simple search)
-                    if key in ('type', 'device'):
-                        continue
-                    
-                    if is_scalar(value):
-                        # Key format: inputs.<key>
-                        # But wait, user example: inputs.clip_name
-                        # If multiple nodes have same input key, we might have collisions or duplicates.
-                        # For a gallery search, maybe just key=value is enough?
-                        # User asked for "inputs.clip_name" -> "qwen_3_4b.safetensors"
-                        # This implies we lose context of which node it belonged to?
-                        # Or maybe we prefix with node class type?
-                        # User example:
-                        # {"inputs": {"clip_name": "...", ...}, ...} -> inputs.clip_name
-                        # If there are multiple nodes with 'clip_name', we will just capture all of them.
-                        # We will start with strict "inputs.<key>"
-                        
-                        db_key = f"inputs.{key}"
-                        # We might overwrite if multiple nodes have same param. 
-                        # But user asked for "save in the database A KEY named inputs.clip_name"
-                        # This implies uniqueness or multimap.
-                        # Our ImageMetadata table allows multiple rows for same image.
-                        # But 'key' is just a string.
-                        # We will store: key="inputs.clip_name", value="qwen..."
-                        # If multiple nodes have it, we store multiple rows? 
-                        # Our model has separate Id for every metadata item, so yes we can store duplicates.
-                        
-                        # Let's start with just storing them.
-                        # Optimization: maybe unique set?
-                        flattened_key = f"inputs.{key}"
-                        
-                        # We store as list of tuples locally to handle duplicates?
-            # Reworking to return list of (key, value)
-            items = []
-            for node_id, node_data in data.items():
-                inputs = node_data.get('inputs', {})
-                for inp_key, inp_val in inputs.items():
-                    if inp_key in ('type', 'device'):
-                        continue
-                    if is_scalar(inp_val):
-                        # We flatten as inputs.<key>
-                        # User requested to remove "inputs." prefix
-                        # items.append((f"inputs.{inp_key}", str(inp_val)))
-                        items.append((inp_key, str(inp_val)))
-                    elif isinstance(inp_val, list):
-                        pass # ignore arrays for now or join them?
-                
-            return items
+    roots = {name: sync.initial_sync_status(name) for name in sync.initial_sync_done}
+    if roots and all(status == "ready" for status in roots.values()):
+        return {"status": "ready", "roots": roots}
 
-    except Exception as e:
-        print(f"Error extracting metadata from {filepath}: {e}")
-        return []
+    status = "failed" if "failed" in roots.values() else "indexing"
+    content = {"status": status, "roots": roots}
+    if sync.initial_sync_errors:
+        content["errors"] = dict(sync.initial_sync_errors)
+    return JSONResponse(status_code=503, content=content)
 
-from threading import Lock
-import time
 
-# Global lock for synchronization to prevent race conditions
-sync_lock = Lock()
-last_sync_time = 0
-SYNC_COOLDOWN = 2.0  # Seconds
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
 
-def sync_images(db: Session):
-    global last_sync_time
-    
-    # Non-blocking check first (optional optimization)
-    if time.time() - last_sync_time < SYNC_COOLDOWN:
-        return
-
-    # Acquire lock to ensure only one thread syncs at a time
-    if not sync_lock.acquire(blocking=False):
-        # If locked, assume another thread is syncing and we can skip
-        return
-    
-    try:
-        # Check again after acquiring lock (double-check locking)
-        if time.time() - last_sync_time < SYNC_COOLDOWN:
-            return
-            
-        print("Starting sync...")
-        existing_images = {img.id: img for img in db.query(models.Image).all()}
-        existing_paths = {img.path: img for img in existing_images.values()}
-        
-        # Walk directory
-        for root, dirs, files in os.walk(IMAGES_DIR):
-            for file in files:
-                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.webp', '.mp4', '.webm', '.mov')):
-                    full_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(full_path, IMAGES_DIR)
-                    
-                    mtime = os.path.getmtime(full_path)
-                    created_at = datetime.fromtimestamp(mtime)
-
-                    file_hash = calculate_sha1(full_path)
-                    if not file_hash:
-                        continue
-                    
-                    image_to_process = None
-                    is_new = False
-                    
-                    if file_hash not in existing_images:
-                        # New hash found.
-                        # Check if this path is already claimed by another image (content changed)
-                        if rel_path in existing_paths:
-                            old_img = existing_paths[rel_path]
-                            # Delete the old image since the file at this path has changed content
-                            db.delete(old_img)
-                            # Flush to ensure the path is freed before we try to insert a new image with the same path
-                            db.flush()
-                            
-                            if old_img.id in existing_images:
-                                del existing_images[old_img.id]
-                            del existing_paths[rel_path]
-                        
-                        # New image
-                        db_image = models.Image(id=file_hash, path=rel_path, created_at=created_at)
-                        db.add(db_image)
-                        
-                        # Update local lookups
-                        existing_images[file_hash] = db_image
-                        existing_paths[rel_path] = db_image
-                        
-                        image_to_process = db_image
-                        is_new = True
-                    else:
-                        existing_img = existing_images[file_hash]
-                        if existing_img.created_at != created_at:
-                             existing_img.created_at = created_at
-                             db.add(existing_img)
-                        
-                        if existing_img.path != rel_path:
-                            # Path mismatch. 
-                            # Check if old path is invalid (doesn't exist)
-                            old_full_path = os.path.join(IMAGES_DIR, existing_img.path)
-                            if not os.path.exists(old_full_path):
-                                # The file moved from old_path to rel_path
-                                
-                                # Check if rel_path is free
-                                if rel_path in existing_paths and existing_paths[rel_path].id != existing_img.id:
-                                    # Target path is occupied by ANOTHER image.
-                                    occupant = existing_paths[rel_path]
-                                    db.delete(occupant)
-                                    db.flush() # Flush here too
-                                    if occupant.id in existing_images:
-                                        del existing_images[occupant.id]
-                                    del existing_paths[rel_path]
-
-                                # Now move
-                                # We must also remove the old path claim
-                                if existing_img.path in existing_paths:
-                                    del existing_paths[existing_img.path]
-                                    
-                                existing_img.path = rel_path
-                                db.add(existing_img)
-                                existing_paths[rel_path] = existing_img
-                                
-                        if not existing_img.metadata_items: 
-                             image_to_process = existing_img
-                    
-                    if image_to_process:
-                        # Extract and save metadata
-                        # Only for PNGs usually, but check extension inside or let pillow handle
-                        if file.lower().endswith('.png'):
-                            meta_items = extract_metadata(full_path)
-                            # delete existing just in case (e.g. re-processing)
-                            if not is_new:
-                                 db.query(models.ImageMetadata).filter(models.ImageMetadata.image_id == image_to_process.id).delete()
-    
-                            for k, v in meta_items:
-                                db.add(models.ImageMetadata(image_id=image_to_process.id, key=k, value=v))
-                        
-                            # Update Search Index
-                            # We delete old FTS entry first
-                            db.execute(text("DELETE FROM search_index WHERE image_id = :id"), {"id": image_to_process.id})
-                            
-                            # Aggregate content: path + prompt + all metadata values
-                            search_content = [image_to_process.path, getattr(image_to_process, 'prompt', '') or ""]
-                            search_content.extend([v for k, v in meta_items])
-                            full_text = " ".join(search_content)
-                            
-                            db.execute(text("INSERT INTO search_index (image_id, content) VALUES (:id, :content)"), 
-                                       {"id": image_to_process.id, "content": full_text})
-        
-        db.commit()
-        last_sync_time = time.time()
-        print(f"Sync complete. Images: {len(existing_images)}")
-    
-    finally:
-        sync_lock.release()
+    # Allow CORS for frontend
+    allowed_origins_env = os.environ.get("CORS_ALLOWED_ORIGINS", "http://localhost:8188")
+    allowed_origins = [origin.strip() for origin in allowed_origins_env.split(",")]
 
-# Mount frontend assets
-import sys
-# Determine path to web directory
-# In development, it might be in src/genai_gallery/web
-# In installed package, it is adjacent to this file
-web_dir = os.path.join(os.path.dirname(__file__), "web")
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=allowed_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
 
-if os.path.exists(web_dir):
-    app.mount("/assets", StaticFiles(directory=os.path.join(web_dir, "assets")), name="assets")
+    # Compress API responses, the frontend bundle is precompressed at build time
+    app.add_middleware(CompressionMiddleware, minimum_size=MINIMUM_SIZE)
+
+    app.include_router(router)
+
+    # Mount images directories to serve static files, one per root when there are several
+    if is_federated():
+        for root in get_roots():
+            app.mount(f"/images/{root.name}", StaticFiles(directory=root.path), name=f"images-{root.name}")
+    else:
+        app.mount("/images", StaticFiles(directory=get_roots()[0].path), name="images")
+
+    # Mount frontend assets
+    # Determine path to web directory
+    # In development, it might be in src/genai_gallery/web
+    # In installed package, it is adjacent to this file
+    web_dir = os.path.join(os.path.dirname(__file__), "web")
+
+    if os.path.exists(web_dir):
+        # Asset file names carry a content hash, so they can be cached forever
+        app.mount(
+            "/assets",
+            PrecompressedStaticFiles(directory=os.path.join(web_dir, "assets"), cache_control=IMMUTABLE_CACHE_CONTROL),
+            name="assets",
+        )
+
+        # Serve index.html for root and SPA fallback
+        @app.get("/{full_path:path}")
+        async def serve_frontend(full_path: str, request: Request):
+            # This is the LAST route, so it captures everything the API router didn't.
+            # We should only return index.html for non-api routes.
+            if full_path.startswith("api/") or full_path.startswith("images/"):
+                 raise HTTPException(status_code=404, detail="Not found")
+
+            # Check if file exists in web dir (e.g. favicon.ico)
+            file_path = os.path.join(web_dir, full_path)
+            if not os.path.isfile(file_path):
+                file_path = os.path.join(web_dir, "index.html")
+
+            return precompressed_file_response(file_path, request.headers)
+
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    # `genai_gallery.main:app` keeps working for `uvicorn --reload`, but the
+    # application is only built when something actually asks for it.
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _positive_int(value: str) -> int:
+    import argparse
+
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid integer: {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value!r}")
+    return number
 
-    # Serve index.html for root and SPA fallback
-    from fastapi.responses import FileResponse
-    
-    @app.get("/{full_path:path}")
-    async def serve_frontend(full_path: str):
-        # Allow API calls (defined above) to pass through? 
-        # FastAPI executes in order. Since this is the LAST route, it captures everything else.
-        # But we must ensure it doesn't capture /api/ (which handles 404s itself usually?)
-        # If /api/ route is missing, it falls through here.
-        # We should only return index.html for non-api routes.
-        if full_path.startswith("api/") or full_path.startswith("images/"):
-             raise HTTPException(status_code=404, detail="Not found")
-        
-        # Check if file exists in web dir (e.g. favicon.ico)
-        file_path = os.path.join(web_dir, full_path)
-        if os.path.isfile(file_path):
-            return FileResponse(file_path)
-            
-        return FileResponse(os.path.join(web_dir, "index.html"))
 
 def main():
+    import argparse
     import uvicorn
-    port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="127.0.0.1", port=port)
+
+    parser = argparse.ArgumentParser(prog="genai_gallery", description="GenAI Gallery server")
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"),
+                        help="Address to bind to (default: 127.0.0.1, env: HOST)")
+    # String defaults go through `type` too, so bad env values get a usage error
+    parser.add_argument("--port", type=_positive_int, default=os.environ.get("PORT", "8000"),
+                        help="Port to listen on (default: 8000, env: PORT)")
+    parser.add_argument("--workers", type=_positive_int, default=os.environ.get("WORKERS", "1"),
+                        help="Number of worker processes (default: 1, env: WORKERS). "
+                             "Only one worker indexes at a time, all of them serve requests.")
+    args = parser.parse_args()
+
+    # Validate configuration before spawning any workers
+    get_roots()
+
+    uvicorn.run(
+        "genai_gallery.main:create_app",
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+    )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,67 @@
+"""
+Versioned schema migrations.
+
+The schema version is tracked in SQLite's `PRAGMA user_version`. Each entry in
+MIGRATIONS upgrades the database by exactly one version; `run_migrations`
+applies whatever is missing, once per library root, at application startup.
+"""
+from sqlalchemy import text
+
+from . import models
+from .config import LibraryRoot
+from .database import get_engine
+from .locking import FileLock
+
+
+def _initial_schema(connection):
+    # Databases created before versioning existed already have these tables,
+    # so every statement here must be idempotent.
+    models.Base.metadata.create_all(bind=connection)
+    connection.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(image_id UNINDEXED, content)"))
+
+
+def _sync_state(connection):
+    # Single-row table holding sync state shared by all worker processes
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS sync_state ("
+        "id INTEGER PRIMARY KEY CHECK (id = 1), "
+        "last_sync_time REAL NOT NULL DEFAULT 0)"
+    ))
+    connection.execute(text("INSERT OR IGNORE INTO sync_state (id) VALUES (1)"))
+
+
+def _prompt_vectors(connection):
+    # Maps images to their row in the prompt vectors matrix, see vectors.py.
+    # A NULL row means the image has no prompt text.
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS prompt_vectors ("
+        "image_id TEXT PRIMARY KEY, "
+        "row INTEGER)"
+    ))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_prompt_vectors_row ON prompt_vectors (row)"))
+
+
+MIGRATIONS = [
+    _initial_schema,
+    _sync_state,
+    _prompt_vectors,
+]
+
+
+def get_schema_version(connection) -> int:
+    return connection.execute(text("PRAGMA user_version")).scalar()
+
+
+def run_migrations(root: LibraryRoot) -> int:
+    engine = get_engine(root)
+
+    # Several workers may start at once; only one of them migrates, the
+    # others wait and then find the schema already up to date.
+    with FileLock(root.db_path + ".migrate.lock"), engine.begin() as connection:
+        version = get_schema_version(connection)
+        for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            print(f"Migrating {root.name} database to schema version {target}...")
+            migration(connection)
+            # PRAGMA does not accept bound parameters
+            connection.execute(text(f"PRAGMA user_version = {target}"))
+        return len(MIGRATIONS)
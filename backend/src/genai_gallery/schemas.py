@@ -22,6 +22,9 @@ class ImageBase(BaseModel):
 class Image(ImageBase):
     metadata_items: List[ImageMetadataBase] = []
 
+class SimilarImage(Image):
+    score: float
+
 class PaginatedImageResponse(BaseModel):
     items: List[Image]
     total: int
@@ -0,0 +1,363 @@
+import os
+import hashlib
+import threading
+import time
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+
+from . import models
+from .config import LibraryRoot, get_roots
+from .locking import FileLock
+
+def calculate_sha1(filepath: str) -> str:
+    sha1 = hashlib.sha1()
+    try:
+        with open(filepath, 'rb') as f:
+            while True:
+                data = f.read(65536)
+                if not data:
+                    break
+                sha1.update(data)
+        return sha1.hexdigest()
+    except IOError:
+        return None
+
+def extract_metadata(filepath: str) -> dict:
+    """
+    Extracts ComfyUI Prompt metadata from PNG files.
+    Returns a dict of flattened key-value pairs.
+    """
+    try:
+        from PIL import Image
+        with Image.open(filepath) as img:
+            # ComfyUI often stores prompt in 'prompt' or 'workflow' text chunks
+            # We are interested in 'prompt' which contains the inputs
+            meta = img.info
+            prompt_json = meta.get('prompt')
+            if not prompt_json:
+                return {}
+            
+            import json
+            data = json.loads(prompt_json)
+            
+            flattened = {}
+            
+            # Helper to check if value is scalar
+            def is_scalar(v):
+                return isinstance(v, (str, int, float, bool)) and v is not None
+
+            # Flatten inputs
+            # Structure: { <node_id>: { "inputs": { ... }, "class_type": ... }, ... }
+            for node_id, node_data in data.items():
+                inputs = node_data.get('inputs', {})
+                for key, value in inputs.items():
+                    # Ignore 'type' and 'device' as per user request
+                    # Also ignoring non-scalar values (lists, dicts are usually connections/arrays we don't need for simple search)
+                    if key in ('type', 'device'):
+                        continue
+                    
+                    if is_scalar(value):
+                        # Key format: inputs.<key>
+                        # But wait, user example: inputs.clip_name
+                        # If multiple nodes have same input key, we might have collisions or duplicates.
+                        # For a gallery search, maybe just key=value is enough?
+                        # User asked for "inputs.clip_name" -> "qwen_3_4b.safetensors"
+                        # This implies we lose context of which node it belonged to?
+                        # Or maybe we prefix with node class type?
+                        # User example:
+                        # {"inputs": {"clip_name": "...", ...}, ...} -> inputs.clip_name
+                        # If there are multiple nodes with 'clip_name', we will just capture all of them.
+                        # We will start with strict "inputs.<key>"
+                        
+                        db_key = f"inputs.{key}"
+                        # We might overwrite if multiple nodes have same param. 
+                        # But user asked for "save in the database A KEY named inputs.clip_name"
+                        # This implies uniqueness or multimap.
+                        # Our ImageMetadata table allows multiple rows for same image.
+                        # But 'key' is just a string.
+                        # We will store: key="inputs.clip_name", value="qwen..."
+                        # If multiple nodes have it, we store multiple rows? 
+                        # Our model has separate Id for every metadata item, so yes we can store duplicates.
+                        
+                        # Let's start with just storing them.
+                        # Optimization: maybe unique set?
+                        flattened_key = f"inputs.{key}"
+                        
+                        # We store as list of tuples locally to handle duplicates?
+            # Reworking to return list of (key, value)
+            items = []
+            for node_id, node_data in data.items():
+                inputs = node_data.get('inputs', {})
+                for inp_key, inp_val in inputs.items():
+                    if inp_key in ('type', 'device'):
+                        continue
+                    if is_scalar(inp_val):
+                        # We flatten as inputs.<key>
+                        # User requested to remove "inputs." prefix
+                        # items.append((f"inputs.{inp_key}", str(inp_val)))
+                        items.append((inp_key, str(inp_val)))
+                    elif isinstance(inp_val, list):
+                        pass # ignore arrays for now or join them?
+                
+            return items
+
+    except Exception as e:
+        print(f"Error extracting metadata from {filepath}: {e}")
+        return []
+
+# Every library root is synced independently, so all the state below is keyed
+# by root name.
+# Locks for synchronization to prevent race conditions between threads.
+# Workers in other processes are excluded by a file lock next to the database.
+sync_locks = {}
+_sync_locks_lock = threading.Lock()
+# Local copies of the shared `sync_state.last_sync_time`, refreshed on every sync attempt,
+# or the time of the last attempt that found another sync running
+last_sync_times = {}
+SYNC_COOLDOWN = 2.0  # Seconds
+
+# Set once the startup sync of each root has succeeded, see `start_initial_sync`
+initial_sync_done = {}
+# Error message of the roots whose startup sync failed, until a later sync succeeds
+initial_sync_errors = {}
+
+def _get_sync_lock(root: LibraryRoot) -> threading.Lock:
+    with _sync_locks_lock:
+        return sync_locks.setdefault(root.name, threading.Lock())
+
+def _mark_synced(root: LibraryRoot):
+    # A sync that went through, here or in another worker, makes up for a
+    # failed startup sync, e.g. one that timed out on a locked database
+    initial_sync_errors.pop(root.name, None)
+    if root.name in initial_sync_done:
+        initial_sync_done[root.name].set()
+
+def get_last_sync_time(db: Session) -> float:
+    return db.execute(text("SELECT last_sync_time FROM sync_state WHERE id = 1")).scalar() or 0
+
+def sync_images(root: LibraryRoot, db: Session, blocking: bool = False):
+    # Non-blocking check first (optional optimization)
+    if time.time() - last_sync_times.get(root.name, 0) < SYNC_COOLDOWN:
+        return
+
+    # Acquire lock to ensure only one thread syncs at a time
+    sync_lock = _get_sync_lock(root)
+    if not sync_lock.acquire(blocking=blocking):
+        # If locked, assume another thread is syncing and we can skip. The
+        # attempt starts a cooldown too, so that requests made during a long
+        # sync don't keep trying.
+        last_sync_times[root.name] = time.time()
+        return
+
+    # Same for processes: only one worker indexes, the others keep serving reads
+    process_lock = FileLock(root.db_path + ".sync.lock")
+    if not process_lock.acquire(blocking=blocking):
+        sync_lock.release()
+        last_sync_times[root.name] = time.time()
+        return
+    
+    try:
+        # Check again after acquiring the locks (double-check locking), using the
+        # shared state since another worker may have just finished a sync
+        last_sync_times[root.name] = get_last_sync_time(db)
+        if time.time() - last_sync_times[root.name] < SYNC_COOLDOWN:
+            _mark_synced(root)
+            return
+        
+        images_dir = root.path
+
+        print(f"Starting sync of {root.name}...")
+        existing_images = {img.id: img for img in db.query(models.Image).all()}
+        existing_paths = {img.path: img for img in existing_images.values()}
+        
+        # Walk directory
+        for dirpath, dirs, files in os.walk(images_dir):
+            for file in files:
+                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.webp', '.mp4', '.webm', '.mov')):
+                    full_path = os.path.join(dirpath, file)
+                    rel_path = os.path.relpath(full_path, images_dir)
+                    
+                    mtime = os.path.getmtime(full_path)
+                    created_at = datetime.fromtimestamp(mtime)
+
+                    file_hash = calculate_sha1(full_path)
+                    if not file_hash:
+                        continue
+                    
+                    image_to_process = None
+                    is_new = False
+                    
+                    if file_hash not in existing_images:
+                        # New hash found.
+                        # Check if this path is already claimed by another image (content changed)
+                        if rel_path in existing_paths:
+                            old_img = existing_paths[rel_path]
+                            # Delete the old image since the file at this path has changed content
+                            db.delete(old_img)
+                            # Flush to ensure the path is freed before we try to insert a new image with the same path
+                            db.flush()
+                            
+                            if old_img.id in existing_images:
+                                del existing_images[old_img.id]
+                            del existing_paths[rel_path]
+                        
+                        # New image
+                        db_image = models.Image(id=file_hash, path=rel_path, created_at=created_at)
+                        db.add(db_image)
+                        
+                        # Update local lookups
+                        existing_images[file_hash] = db_image
+                        existing_paths[rel_path] = db_image
+                        
+                        image_to_process = db_image
+                        is_new = True
+                    else:
+                        existing_img = existing_images[file_hash]
+                        if existing_img.created_at != created_at:
+                             existing_img.created_at = created_at
+                             db.add(existing_img)
+                        
+                        if existing_img.path != rel_path:
+                            # Path mismatch. 
+                            # Check if old path is invalid (doesn't exist)
+                            old_full_path = os.path.join(images_dir, existing_img.path)
+                            if not os.path.exists(old_full_path):
+                                # The file moved from old_path to rel_path
+                                
+                                # Check if rel_path is free
+                                if rel_path in existing_paths and existing_paths[rel_path].id != existing_img.id:
+                                    # Target path is occupied by ANOTHER image.
+                                    occupant = existing_paths[rel_path]
+                                    db.delete(occupant)
+                                    db.flush() # Flush here too
+                                    if occupant.id in existing_images:
+                                        del existing_images[occupant.id]
+                                    del existing_paths[rel_path]
+
+                                # Now move
+                                # We must also remove the old path claim
+                                if existing_img.path in existing_paths:
+                                    del existing_paths[existing_img.path]
+                                    
+                                existing_img.path = rel_path
+                                db.add(existing_img)
+                                existing_paths[rel_path] = existing_img
+                                
+                        if not existing_img.metadata_items: 
+                             image_to_process = existing_img
+                    
+                    if image_to_process:
+                        # Extract and save metadata
+                        # Only for PNGs usually, but check extension inside or let pillow handle
+                        if file.lower().endswith('.png'):
+                            meta_items = extract_metadata(full_path)
+                            # delete existing just in case (e.g. re-processing)
+                            if not is_new:
+                                 db.query(models.ImageMetadata).filter(models.ImageMetadata.image_id == image_to_process.id).delete()
+    
+                            for k, v in meta_items:
+                                db.add(models.ImageMetadata(image_id=image_to_process.id, key=k, value=v))
+                        
+                            # Update Search Index
+                            # We delete old FTS entry first
+                            db.execute(text("DELETE FROM search_index WHERE image_id = :id"), {"id": image_to_process.id})
+                            # Its prompt vector is recomputed by update_prompt_vectors below
+                            db.execute(text("DELETE FROM prompt_vectors WHERE image_id = :id"), {"id": image_to_process.id})
+                            
+                            # Aggregate content: path + prompt + all metadata values
+                            search_content = [image_to_process.path, getattr(image_to_process, 'prompt', '') or ""]
+                            search_content.extend([v for k, v in meta_items])
+                            full_text = " ".join(search_content)
+                            
+                            db.execute(text("INSERT INTO search_index (image_id, content) VALUES (:id, :content)"), 
+                                       {"id": image_to_process.id, "content": full_text})
+        
+        # Imported here, numpy is only needed once there is something to sync
+        from .vectors import update_prompt_vectors
+        update_prompt_vectors(root, db)
+
+        now = time.time()
+        db.execute(text("UPDATE sync_state SET last_sync_time = :time WHERE id = 1"), {"time": now})
+        db.commit()
+        last_sync_times[root.name] = now
+        _mark_synced(root)
+        print(f"Sync of {root.name} complete. Images: {len(existing_images)}")
+    
+    finally:
+        process_lock.release()
+        sync_lock.release()
+
+
+# Roots with a background sync scheduled or running, see `request_sync`
+_pending_syncs = set()
+_pending_syncs_lock = threading.Lock()
+
+def request_sync(root: LibraryRoot):
+    """
+    Schedules a sync of the root in a background thread, unless it is in
+    its cooldown or one is already scheduled. Never blocks, so request
+    handlers call it and go on to read whatever is indexed so far.
+    """
+    if time.time() - last_sync_times.get(root.name, 0) < SYNC_COOLDOWN:
+        return
+
+    with _pending_syncs_lock:
+        if root.name in _pending_syncs:
+            return
+        _pending_syncs.add(root.name)
+
+    from .database import get_session
+
+    def run():
+        db = get_session(root)
+        try:
+            sync_images(root, db)
+        except Exception as e:
+            print(f"Sync of {root.name} failed: {e}")
+        finally:
+            db.close()
+            with _pending_syncs_lock:
+                _pending_syncs.discard(root.name)
+
+    threading.Thread(target=run, name=f"sync-{root.name}", daemon=True).start()
+
+
+def start_initial_sync():
+    """
+    Indexes every library root in its own background thread, so the server
+    can start accepting requests right away and a slow root does not hold
+    back the others. Requests made meanwhile are served from whatever is
+    already in the databases.
+    """
+    from .database import get_session
+
+    def run(root):
+        db = get_session(root)
+        try:
+            sync_images(root, db, blocking=True)
+        except Exception as e:
+            print(f"Initial sync of {root.name} failed: {e}")
+            initial_sync_errors[root.name] = str(e)
+        else:
+            initial_sync_done[root.name].set()
+        finally:
+            db.close()
+
+    threads = []
+    for root in get_roots():
+        initial_sync_done[root.name] = threading.Event()
+        initial_sync_errors.pop(root.name, None)
+        thread = threading.Thread(target=run, args=(root,), name=f"initial-sync-{root.name}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def initial_sync_status(name: str) -> str:
+    """`ready`, `failed` or `indexing`, for the startup sync of a root."""
+    if name in initial_sync_errors:
+        return "failed"
+    if initial_sync_done[name].is_set():
+        return "ready"
+    return "indexing"
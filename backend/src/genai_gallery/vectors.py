@@ -0,0 +1,317 @@
+"""
+Local prompt similarity index.
+
+Every image's positive prompt text is turned into a hashed vector of word and
+character trigram counts (no models, nothing leaves the machine). Vectors
+are L2 normalized float32 rows, each stored with its image id, appended to a
+matrix file next to the database, which is memory mapped for queries, so
+similarity is a single matrix-vector product. The `prompt_vectors` table maps
+image ids to rows; only the ids of the best scoring rows are checked in it.
+
+Rows are only ever written by the sync, which holds the sync lock of the
+root. When an image's metadata is re-extracted its mapping is deleted and
+the next sync appends a fresh row; orphaned rows are skipped by queries.
+Once they make up a good part of the file, the sync rewrites it without
+them and atomically replaces it. Rows are renumbered then, but as each row
+carries its image id, readers still holding the old file or old mappings
+stay correct.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import LibraryRoot
+
+DIMENSIONS = 512
+DTYPE = np.float32
+# SHA1 hex image id, then the vector
+ROW_DTYPE = np.dtype([("image_id", "S40"), ("vector", DTYPE, DIMENSIONS)])
+ROW_BYTES = ROW_DTYPE.itemsize
+
+# The matrix is rewritten without orphaned rows once there are more of them
+# than this share of all rows, and at least COMPACT_MIN_ORPHANS
+COMPACT_ORPHAN_RATIO = 0.25
+COMPACT_MIN_ORPHANS = 64
+COMPACT_CHUNK_ROWS = 4096
+
+# Inputs holding prompt text in ComfyUI workflows
+PROMPT_KEYS = ("text", "prompt", "positive", "text_g", "text_l")
+
+
+def _is_link(value) -> bool:
+    # Connections are stored as [<node_id>, <output_index>]
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[1], int)
+
+
+def _upstream(graph: dict, start_input: str, skip_input: str) -> set:
+    """
+    Ids of the nodes feeding the `start_input` of any node, without going
+    through their `skip_input` (conditioning nodes pass both along).
+    """
+    pending = [
+        str(inputs[start_input][0])
+        for inputs in (node.get("inputs", {}) for node in graph.values())
+        if _is_link(inputs.get(start_input))
+    ]
+    seen = set()
+    while pending:
+        node_id = pending.pop()
+        if node_id in seen or node_id not in graph:
+            continue
+        seen.add(node_id)
+        for key, value in graph[node_id].get("inputs", {}).items():
+            if key != skip_input and _is_link(value):
+                pending.append(str(value[0]))
+    return seen
+
+
+def extract_positive_prompt(filepath: str) -> str:
+    """
+    Returns the positive prompt text of a ComfyUI PNG, or an empty string.
+    Text of nodes that only feed a sampler's `negative` input is left out;
+    nodes feeding neither side (guiders without positive/negative inputs)
+    count as positive.
+    """
+    try:
+        with Image.open(filepath) as img:
+            prompt_json = img.info.get("prompt")
+        if not prompt_json:
+            return ""
+        graph = json.loads(prompt_json)
+
+        positive = _upstream(graph, "positive", "negative")
+        negative = _upstream(graph, "negative", "positive") - positive
+        return " ".join(
+            value
+            for node_id, node in graph.items()
+            if node_id not in negative
+            for key, value in node.get("inputs", {}).items()
+            if key in PROMPT_KEYS and isinstance(value, str)
+        )
+    except Exception as e:
+        print(f"Error extracting prompt from {filepath}: {e}")
+        return ""
+
+
+def prompt_text(root: LibraryRoot, image) -> str:
+    if image.prompt:
+        return image.prompt
+    # Read from the workflow itself: the flattened metadata can't tell
+    # positive and negative prompts apart
+    if image.path.lower().endswith(".png"):
+        return extract_positive_prompt(os.path.join(root.path, image.path))
+    return ""
+
+
+def _features(prompt: str):
+    words = re.findall(r"[a-z0-9]+", prompt.lower())
+    padded = f" {' '.join(words)} "
+    return words + [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+@lru_cache(maxsize=65536)
+def _bucket(feature: str):
+    # A stable hash, unlike hash(), so every process agrees on the layout
+    h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+    return h % DIMENSIONS, (1.0 if h >> 63 else -1.0)
+
+
+def vectorize(prompt: str):
+    """
+    Returns the normalized vector for a prompt, or None if it has no text.
+    """
+    counts = Counter(_features(prompt))
+    if not counts:
+        return None
+
+    vector = np.zeros(DIMENSIONS, dtype=DTYPE)
+    for feature, count in counts.items():
+        index, sign = _bucket(feature)
+        vector[index] += sign * (1.0 + math.log(count))
+
+    norm = np.linalg.norm(vector)
+    if not norm:
+        return None
+    return vector / norm
+
+
+def _row_count(root: LibraryRoot) -> int:
+    try:
+        return os.path.getsize(root.vectors_path) // ROW_BYTES
+    except OSError:
+        return 0
+
+
+def load_matrix(root: LibraryRoot):
+    rows = _row_count(root)
+    if not rows:
+        return None
+    return np.memmap(root.vectors_path, dtype=ROW_DTYPE, mode="r", shape=(rows,))
+
+
+def _append_rows(root: LibraryRoot, image_ids, vectors) -> int:
+    """Appends vectors to the matrix file and returns the index of the first one."""
+    rows = np.empty(len(vectors), dtype=ROW_DTYPE)
+    rows["image_id"] = image_ids
+    rows["vector"] = vectors
+
+    with open(root.vectors_path, "ab") as f:
+        # Drop a partially written row left by an interrupted append
+        size = f.seek(0, os.SEEK_END)
+        first_row = size // ROW_BYTES
+        if size != first_row * ROW_BYTES:
+            f.truncate(first_row * ROW_BYTES)
+        f.write(rows.tobytes())
+    return first_row
+
+
+def _compact(root: LibraryRoot, db: Session):
+    """
+    Rewrites the matrix file with only the mapped rows, if enough of them
+    are orphaned. Called with the root's sync lock held, the caller commits.
+    """
+    total = _row_count(root)
+    mapped = db.execute(text("SELECT image_id, row FROM prompt_vectors WHERE row IS NOT NULL ORDER BY row")).fetchall()
+    orphans = total - len(mapped)
+    if orphans < max(COMPACT_MIN_ORPHANS, total * COMPACT_ORPHAN_RATIO):
+        return
+
+    print(f"Compacting prompt vectors of {root.name}, dropping {orphans} of {total} rows...")
+    matrix = load_matrix(root)
+    keep = np.fromiter((row for _, row in mapped), dtype=np.int64, count=len(mapped))
+    tmp_path = root.vectors_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for start in range(0, len(keep), COMPACT_CHUNK_ROWS):
+            f.write(matrix[keep[start:start + COMPACT_CHUNK_ROWS]].tobytes())
+    del matrix
+
+    try:
+        # Readers that already mapped the old file keep reading it
+        os.replace(tmp_path, root.vectors_path)
+    except OSError as e:
+        # Windows doesn't replace files another process has mapped, try again next sync
+        print(f"Could not compact prompt vectors of {root.name}: {e}")
+        os.remove(tmp_path)
+        return
+
+    db.execute(
+        text("UPDATE prompt_vectors SET row = :row WHERE image_id = :id"),
+        [{"id": image_id, "row": row} for row, (image_id, _) in enumerate(mapped)],
+    )
+
+
+def update_prompt_vectors(root: LibraryRoot, db: Session) -> int:
+    """
+    Vectorizes every image that has no row yet, then compacts the matrix if
+    needed. Called by the sync with the root's sync lock held, the caller
+    commits.
+    """
+    # Make images and metadata added by the sync visible to the queries below
+    db.flush()
+    db.expire_all()
+
+    db.execute(text("DELETE FROM prompt_vectors WHERE image_id NOT IN (SELECT id FROM images)"))
+    # Rows lost with a missing or truncated matrix file are computed again
+    db.execute(text("DELETE FROM prompt_vectors WHERE row >= :rows"), {"rows": _row_count(root)})
+
+    missing = (
+        db.query(models.Image)
+        .filter(text("images.id NOT IN (SELECT image_id FROM prompt_vectors)"))
+        .all()
+    )
+
+    image_ids = []
+    vectors = []
+    mappings = []
+    for image in missing:
+        vector = vectorize(prompt_text(root, image))
+        if vector is None:
+            # Remember images without a prompt so they are not looked at again
+            mappings.append({"id": image.id, "row": None})
+        else:
+            mappings.append({"id": image.id, "row": len(vectors)})
+            image_ids.append(image.id)
+            vectors.append(vector)
+
+    # Rows are written before their mappings are committed, so readers never
+    # see a mapping to a row that doesn't exist yet
+    first_row = _append_rows(root, image_ids, vectors) if vectors else 0
+    for mapping in mappings:
+        if mapping["row"] is not None:
+            mapping["row"] += first_row
+
+    if mappings:
+        db.execute(text("INSERT OR REPLACE INTO prompt_vectors (image_id, row) VALUES (:id, :row)"), mappings)
+    _compact(root, db)
+    return len(vectors)
+
+
+def get_vector(root: LibraryRoot, db: Session, image_id: str):
+    row = db.execute(text("SELECT row FROM prompt_vectors WHERE image_id = :id"), {"id": image_id}).scalar()
+    matrix = load_matrix(root)
+    if row is None or matrix is None:
+        return None
+
+    if row >= matrix.shape[0] or matrix["image_id"][row] != image_id.encode():
+        # The file was compacted between reading the mapping and mapping it
+        rows = np.flatnonzero(matrix["image_id"] == image_id.encode())
+        if not len(rows):
+            return None
+        row = rows[-1]
+    return np.array(matrix["vector"][row])
+
+
+def find_similar(root: LibraryRoot, db: Session, vector, limit: int, exclude_id: str = None):
+    """
+    Returns up to `limit` `(score, image_id)` pairs of the root's images with
+    the most similar prompts, best first.
+    """
+    matrix = load_matrix(root)
+    if matrix is None or limit <= 0:
+        return []
+
+    scores = matrix["vector"] @ vector
+    # One extra candidate for the excluded image
+    candidates = limit + 1
+    while True:
+        if candidates < len(scores):
+            top = np.argpartition(-scores, candidates - 1)[:candidates]
+        else:
+            top = np.arange(len(scores))
+
+        # Rows are checked by image id, not row number, so this holds even
+        # if the file was compacted meanwhile. Ids are passed as a single
+        # JSON parameter so that any limit fits in one statement.
+        top_ids = [image_id.decode() for image_id in matrix["image_id"][top]]
+        current = {image_id for (image_id,) in db.execute(
+            text(
+                "SELECT image_id FROM prompt_vectors WHERE row IS NOT NULL "
+                "AND image_id IN (SELECT value FROM json_each(:ids))"
+            ),
+            {"ids": json.dumps(top_ids)},
+        )}
+
+        # An image re-vectorized with the same content can have two rows,
+        # with the same vector
+        best = {}
+        for row, image_id in zip(top.tolist(), top_ids):
+            if image_id in current and image_id != exclude_id:
+                best[image_id] = max(best.get(image_id, -math.inf), float(scores[row]))
+
+        # Orphaned rows among the candidates, try again with more of them
+        if len(best) >= limit or len(top) == len(scores):
+            break
+        candidates *= 2
+
+    matches = sorted(((score, image_id) for image_id, score in best.items()), reverse=True)
+    return matches[:limit]